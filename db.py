@@ -0,0 +1,165 @@
+# db.py
+# Koneksi + schema SQLite ISAT
+# Dipakai isat_service.py (runtime) dan init_db.py (inisialisasi manual)
+import os, sqlite3, threading
+from contextlib import contextmanager
+from queue import Queue
+
+DB_PATH = os.environ.get("ISAT_DB", "isat_data.db")
+
+# Statement cache sqlite3 per koneksi; SQL ditulis sekali sebagai konstanta
+# supaya koneksi yang dipakai ulang selalu kena prepared statement yang sama
+DB_CACHED_STATEMENTS = 256
+
+SQL_INSERT_CSQ = "INSERT INTO csq_log (timestamp, rssi, dbm, ber) VALUES (?, ?, ?, ?)"
+
+# 1 query untuk semua kombinasi start/end (None = tanpa batas), end inklusif.
+# Tetap range scan di idx_csq_ts.
+SQL_HISTORY_CSQ = """
+    SELECT timestamp, rssi, dbm, ber FROM csq_log
+    WHERE timestamp >= COALESCE(?, 0)
+      AND timestamp <= COALESCE(?, 9223372036854775807)
+    ORDER BY timestamp ASC LIMIT ?
+"""
+
+SQL_MAX_TS_CSQ = "SELECT MAX(timestamp) FROM csq_log"
+
+# Agregasi per bucket waktu (detik), dibaca dari covering index idx_csq_ts
+SQL_HISTORY_AGG_CSQ = """
+    SELECT (timestamp / ?) * ? AS bucket,
+           AVG(dbm), MIN(dbm), MAX(dbm), AVG(rssi), COUNT(*)
+    FROM csq_log
+    WHERE timestamp >= COALESCE(?, 0)
+      AND timestamp <= COALESCE(?, 9223372036854775807)
+    GROUP BY bucket
+    ORDER BY bucket ASC LIMIT ?
+"""
+
+
+# ==================================================
+# CONNECTION POOL (1 writer + N reader, WAL)
+# ==================================================
+# Semua tulis lewat satu writer (serial lewat write_lock) supaya tidak pernah
+# "database is locked". Reader read-only terpisah: WAL membuat query history
+# tidak menunggu write_lock, tapi di bawah gevent semua greenlet ada di satu
+# OS thread dan call sqlite3 tidak yield, jadi tidak ada paralelisme nyata →
+# cukup 1 koneksi reader.
+READ_POOL_SIZE = 1
+
+DB_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-20000",
+)
+
+writer = None
+write_lock = threading.Lock()
+read_pool = Queue()
+
+
+def connect_write():
+    """Koneksi tulis (autocommit) dengan pragma WAL."""
+    conn = sqlite3.connect(
+        DB_PATH,
+        timeout=10,
+        isolation_level=None,
+        check_same_thread=False,
+        cached_statements=DB_CACHED_STATEMENTS
+    )
+    for pragma in DB_PRAGMAS:
+        conn.execute(pragma)
+    return conn
+
+
+def connect_read():
+    """Koneksi read-only untuk query history."""
+    conn = sqlite3.connect(
+        f"file:{DB_PATH}?mode=ro",
+        uri=True,
+        timeout=10,
+        check_same_thread=False,
+        cached_statements=DB_CACHED_STATEMENTS
+    )
+    conn.execute("PRAGMA busy_timeout=5000")
+    return conn
+
+
+def open_pool():
+    """Buka writer + reader di awal (DB harus sudah ada, panggil setelah create_tables)."""
+    global writer
+
+    writer = connect_write()
+    for _ in range(READ_POOL_SIZE):
+        read_pool.put(connect_read())
+
+
+@contextmanager
+def write_conn():
+    """Pinjam satu-satunya koneksi tulis (eksklusif)."""
+    with write_lock:
+        yield writer
+
+
+@contextmanager
+def read_conn():
+    """Pinjam koneksi read-only dari pool, dikembalikan setelah selesai."""
+    conn = read_pool.get(timeout=10)
+    try:
+        yield conn
+    finally:
+        read_pool.put(conn)
+
+
+# ==================================================
+# SCHEMA
+# ==================================================
+def create_tables():
+    """Buat semua tabel + index kalau belum ada. Error dilempar ke caller."""
+    conn = sqlite3.connect(DB_PATH, timeout=10)
+    cur = conn.cursor()
+
+    # ================= CSQ LOG =================
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS csq_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER,
+            rssi INTEGER,
+            dbm REAL,
+            ber INTEGER
+        )
+    """)
+
+    # index covering untuk range query history + cleanup (tanpa baca tabel utama)
+    cur.execute("""
+        CREATE INDEX IF NOT EXISTS idx_csq_ts
+        ON csq_log (timestamp, rssi, dbm, ber)
+    """)
+
+    # ================= CALL LOGS =================
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS call_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER,
+            source TEXT,
+            number TEXT,
+            status TEXT,
+            cause_code INTEGER,
+            cause_desc TEXT
+        )
+    """)
+
+    # ================= SMS LOGS =================
+    cur.execute("""
+        CREATE TABLE IF NOT EXISTS sms_logs (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            timestamp INTEGER,
+            source TEXT,
+            number TEXT,
+            status TEXT
+        )
+    """)
+
+    conn.commit()
+    conn.close()
@@ -1,17 +1,5 @@
 # init_db.py
-import sqlite3
+from db import create_tables
 
-db = sqlite3.connect('isat_data.db')
-c = db.cursor()
-c.execute('''
-CREATE TABLE IF NOT EXISTS csq_log (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    timestamp INTEGER NOT NULL,
-    rssi INTEGER,
-    dbm REAL,
-    ber INTEGER
-)
-''')
-db.commit()
-db.close()
+create_tables()
 print("DB initialized")
@@ -1,12 +1,26 @@
 # isat_service.py — FIXED VERSION
+# gevent harus patch I/O (socket, select, threading, time) sebelum modul lain di-import
+from gevent import monkey
+monkey.patch_all()
+
+import gevent
+from gevent.pywsgi import WSGIServer
 from flask import Flask, jsonify, request
-import serial, time, re, sqlite3, threading, os, json
+import serial, time, re, sqlite3, threading, os, json, atexit, signal, math
 from flask_cors import CORS
 from datetime import datetime, timedelta, timezone
 from pdu_encoder import encode_pdu
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import orjson
 from isat_pdu_encoder import encode_isatphone_pdu
-from queue import Queue
+from db import (
+    DB_PATH, SQL_INSERT_CSQ, SQL_HISTORY_CSQ, SQL_MAX_TS_CSQ, SQL_HISTORY_AGG_CSQ,
+    create_tables, open_pool, write_conn, read_conn
+)
+from queue import Queue, Full, Empty
+from collections import deque
 
 
 # ==================================================
@@ -19,8 +33,8 @@ PORT = os.environ.get(
 BAUDRATE = 115200
 CONFIG_FILE = "config.json"
 DEFAULT_INTERVAL = 10
-DB_PATH = os.environ.get("ISAT_DB", "isat_data.db")
 FLASK_PORT = int(os.environ.get("ISAT_FLASK_PORT", 8000))
+CLOUD_URL = os.environ.get("ISAT_CLOUD_URL", "").rstrip("/")   # kosong = cloud sync OFF
 SMSC_NUMBER = "+870772001799"
 sms_sending = False
 sms_session_active = False
@@ -50,6 +64,9 @@ last_auto_call_time = 0
 auto_call_duration = 15   
 last_auto_sms_time = 0
 
+auto_call_event = threading.Event()   # set = auto call ON
+auto_call_wake = threading.Event()    # bangunkan auto_call_loop (config berubah)
+
 # =========================
 # TASK QUEUE (FIFO)
 # =========================
@@ -160,27 +177,172 @@ def load_config():
     auto_call_interval = auto_call.get("interval", 60)
     auto_call_number = auto_call.get("number", "")
     auto_call_duration = auto_call.get("duration", 15)
+    apply_auto_call_state()
 
     log("[CONFIG] Loaded from file")
 
 
+def apply_auto_call_state():
+    """Sinkronkan auto_call_event dengan auto_call_enabled, lalu bangunkan loop."""
+    if auto_call_enabled:
+        auto_call_event.set()
+    else:
+        auto_call_event.clear()
+    auto_call_wake.set()
+
+
 # ==================================================
 # SERIAL INIT
 # ==================================================
 ser = None
-serial_lock = threading.Lock()
+serial_lock = threading.RLock()   # sudah di-patch gevent → kooperatif
 current_interval = DEFAULT_INTERVAL
 
+# Semua input serial dibaca serial_reader_loop; read() langsung balik begitu ada
+# byte (select), timeout hanya membatasi wakeup saat modem diam
+SERIAL_READ_TIMEOUT = 0.5
+AT_DEFAULT_TIMEOUT = 2.0
+AT_FINAL_RESULTS = (b"OK", b"ERROR", b"+CME ERROR", b"+CMS ERROR")
+
+# Unsolicited result code: tidak boleh ikut terbuang bersama respon command
+# Hasil akhir call: final result ATD kalau dial langsung gagal, tapi juga
+# datang unsolicited saat call berakhir → dikirim ke kedua queue
+CALL_RESULT_CODES = (b"NO CARRIER", b"BUSY", b"NO ANSWER")
+
+URC_PREFIXES = (
+    b"RING", b"+CRING", b"+CLIP", b"+CMTI", b"+CDSI",
+    b"+SKCCSI",
+) + CALL_RESULT_CODES
+
+at_resp_queue = Queue()            # baris respon AT command
+urc_queue = Queue(maxsize=200)     # baris URC (event call / SMS)
+call_wake = threading.Event()      # bangunkan call_monitor (URC masuk / stop user)
+
 
 def open_serial():
     """Buka port serial ke IsatPhone, simpan di global ser."""
     global ser
     try:
-        ser = serial.Serial(PORT, BAUDRATE, timeout=1)
+        ser = serial.Serial(PORT, BAUDRATE, timeout=SERIAL_READ_TIMEOUT)
         log(f"[SERIAL] Dibuka pada {PORT}")
     except Exception as e:
         log(f"[WARN] Gagal membuka serial: {e}")
         ser = None
+        return
+
+    # Linux low-latency (ASYNC_LOW_LATENCY), tidak semua driver tty support
+    try:
+        ser.set_low_latency_mode(True)
+        log("[SERIAL] Low latency mode aktif")
+    except Exception as e:
+        log(f"[SERIAL] Low latency mode tidak tersedia: {e}")
+
+
+def dispatch_serial_line(line: bytes):
+    if line.startswith(URC_PREFIXES):
+        log(f"[URC] {line.decode(errors='ignore')}")
+        if urc_queue.full():
+            urc_queue.get_nowait()   # buang yang paling lama
+        urc_queue.put_nowait(line)
+        call_wake.set()
+
+        if line.startswith(CALL_RESULT_CODES):
+            at_resp_queue.put(line)
+    else:
+        at_resp_queue.put(line)
+
+
+def serial_reader_loop():
+    """Satu-satunya pembaca port serial: pecah per baris lalu dispatch."""
+    global ser
+
+    log("[SERIAL] Reader started")
+    buf = b""
+
+    while True:
+        if ser is None:
+            buf = b""
+            time.sleep(1)
+            continue
+
+        try:
+            chunk = ser.read(ser.in_waiting or 1)
+        except Exception as e:
+            log(f"[SERIAL][ERROR] Reader: {e}")
+            try:
+                ser.close()
+            except Exception:
+                pass
+            ser = None
+            continue
+
+        if not chunk:
+            continue
+
+        buf += chunk
+        *lines, buf = buf.split(b"\n")
+
+        for line in lines:
+            line = line.strip()
+            if line:
+                dispatch_serial_line(line)
+
+        # prompt CMGS "> " tidak diakhiri newline
+        if buf.strip() == b">":
+            at_resp_queue.put(b">")
+            buf = b""
+
+
+def drain_queue(q: Queue) -> list:
+    items = []
+    while True:
+        try:
+            items.append(q.get_nowait())
+        except Empty:
+            return items
+
+
+def at_command_raw(cmd: bytes, timeout: float = AT_DEFAULT_TIMEOUT,
+                   final: tuple = AT_FINAL_RESULTS) -> bytes:
+    """
+    Kirim AT command lalu kumpulkan baris respon sampai final result
+    (OK / ERROR / ...) atau deadline habis. Harus dipanggil di dalam serial_lock.
+    """
+    # sisa respon command sebelumnya dibuang; URC aman di urc_queue
+    drain_queue(at_resp_queue)
+    ser.write(cmd)
+
+    lines = []
+    deadline = time.monotonic() + timeout
+
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+
+        try:
+            line = at_resp_queue.get(timeout=remaining)
+        except Empty:
+            break
+
+        lines.append(line)
+        if line.startswith(final):
+            break
+
+    return b"\r\n".join(lines)
+
+
+def at_command(cmd: bytes, timeout: float = AT_DEFAULT_TIMEOUT,
+               final: tuple = AT_FINAL_RESULTS) -> str:
+    """Sama seperti at_command_raw, hasil sudah di-decode ke str."""
+    return at_command_raw(cmd, timeout, final).decode(errors="ignore")
+
+
+def drain_urcs() -> str:
+    """Ambil semua URC yang sudah masuk (NO CARRIER, +SKCCSI, ...) sebagai teks."""
+    return "\r\n".join(
+        line.decode(errors="ignore") for line in drain_queue(urc_queue)
+    )
 
 
 open_serial()
@@ -190,47 +352,8 @@ open_serial()
 # ==================================================
 def init_db():
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=10)
-        cur = conn.cursor()
-
-        # ================= CSQ LOG =================
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS csq_log (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp INTEGER,
-                rssi INTEGER,
-                dbm REAL,
-                ber INTEGER
-            )
-        """)
-
-        # ================= CALL LOGS =================
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS call_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp INTEGER,
-                source TEXT,
-                number TEXT,
-                status TEXT,
-                cause_code INTEGER,
-                cause_desc TEXT
-            )
-        """)
-
-        # ================= SMS LOGS =================
-        cur.execute("""
-            CREATE TABLE IF NOT EXISTS sms_logs (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                timestamp INTEGER,
-                source TEXT,
-                number TEXT,
-                status TEXT
-            )
-        """)
-
-        conn.commit()
-        conn.close()
-
+        create_tables()
+        open_pool()
         log("[INIT] Database ready (CSQ + CALL + SMS + CAUSE SUPPORT)")
 
     except Exception as e:
@@ -248,20 +371,23 @@ def cleanup_old_data():
         try:
             cutoff = int(time.time()) - (7 * 24 * 3600)
 
-            conn = sqlite3.connect(DB_PATH)
-            cur = conn.cursor()
-
-            # Hapus CSQ lama
-            cur.execute("DELETE FROM csq_log WHERE timestamp < ?", (cutoff,))
+            with write_conn() as conn:
+                conn.execute("BEGIN")
+                try:
+                    # Hapus CSQ lama
+                    conn.execute("DELETE FROM csq_log WHERE timestamp < ?", (cutoff,))
 
-            # Hapus call log lama
-            cur.execute("DELETE FROM call_logs WHERE timestamp < ?", (cutoff,))
+                    # Hapus call log lama
+                    conn.execute("DELETE FROM call_logs WHERE timestamp < ?", (cutoff,))
 
-            # Hapus sms log lama
-            cur.execute("DELETE FROM sms_logs WHERE timestamp < ?", (cutoff,))
+                    # Hapus sms log lama
+                    conn.execute("DELETE FROM sms_logs WHERE timestamp < ?", (cutoff,))
 
-            conn.commit()
-            conn.close()
+                    conn.execute("COMMIT")
+                except Exception:
+                    conn.execute("ROLLBACK")
+                    raise
+            bump_history_version()
 
             log("[CLEANUP] Old data (>7 days) deleted")
 
@@ -375,14 +501,11 @@ RSSI_DEDICATED_TABLE = {
 # ==================================================
 # DBM CALCULATOR
 # ==================================================
-def calculate_dbm_from_table(rssi: int, dedicated: bool = False):
-    """Hitung dBm berdasarkan RSSI + mode (idle/dedicated) pakai tabel GMR2P."""
-    table = RSSI_DEDICATED_TABLE if dedicated else RSSI_IDLE_TABLE
-
-    if rssi not in table:
-        return None
-
-    low, high = table[rssi]
+def range_to_dbm(low: float, high: float):
+    """Nilai dBm wakil satu range GMR2P (titik tengah, atau batas kalau open-ended)."""
+    if low == -999:
+        # range open-ended (<= high)
+        return high
     if high == -999:
         # range open-ended (>= low)
         return low
@@ -391,16 +514,38 @@ def calculate_dbm_from_table(rssi: int, dedicated: bool = False):
     return (low + high) / 2.0
 
 
+# Tabel dBm siap pakai, index = RSSI (key tabel GMR2P rapat 0..N)
+DBM_IDLE_TABLE = tuple(
+    range_to_dbm(*RSSI_IDLE_TABLE[i]) for i in range(len(RSSI_IDLE_TABLE))
+)
+DBM_DEDICATED_TABLE = tuple(
+    range_to_dbm(*RSSI_DEDICATED_TABLE[i]) for i in range(len(RSSI_DEDICATED_TABLE))
+)
+
+
+def calculate_dbm_from_table(rssi: int, dedicated: bool = False):
+    """Hitung dBm berdasarkan RSSI + mode (idle/dedicated) pakai tabel GMR2P."""
+    table = DBM_DEDICATED_TABLE if dedicated else DBM_IDLE_TABLE
+
+    if 0 <= rssi < len(table):
+        return table[rssi]
+    return None
+
+
 # ==================================================
 # PARSE AT+CSQ (DEDICATED)
 # ==================================================
-def parse_csq_response(resp: str):
+# bytes pattern: respon serial langsung di-parse tanpa decode
+CSQ_RE = re.compile(rb"\+CSQ:\s*(\d+),(\d+)")
+
+
+def parse_csq_response(resp: bytes):
     global call_state
 
     if not resp:
         return None, None, None
 
-    m = re.search(r"\+CSQ:\s*(\d+),(\d+)", resp)
+    m = CSQ_RE.search(resp)
     if not m:
         return None, None, None
 
@@ -430,10 +575,7 @@ def read_csq_once():
 
     try:
         with serial_lock:
-            ser.reset_input_buffer()
-            ser.write(b"AT+CSQ\r")
-            time.sleep(0.3)
-            resp = ser.read_all().decode(errors="ignore")
+            resp = at_command_raw(b"AT+CSQ\r")
 
         return parse_csq_response(resp)
 
@@ -445,18 +587,131 @@ def read_csq_once():
 # ==================================================
 # DB INSERT
 # ==================================================
-def insert_csq(ts: int, rssi: int, dbm: float, ber: int):
+def insert_csq_many(rows: list):
+    """Insert banyak (ts, rssi, dbm, ber) dalam satu transaksi. Error dilempar ke caller."""
+    with write_conn() as conn:
+        conn.execute("BEGIN")
+        try:
+            conn.executemany(SQL_INSERT_CSQ, rows)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+    bump_history_version()
+
+
+# ==================================================
+# CSQ BATCH BUFFER (1 transaksi per batch)
+# ==================================================
+CSQ_BATCH_SIZE = 10
+CSQ_FLUSH_SECS = 5
+
+csq_pending = deque()
+csq_pending_lock = threading.Lock()
+last_csq_flush = time.monotonic()   # monotonic, kebal koreksi jam NTP
+
+
+def queue_csq(ts: int, rssi: int, dbm: float, ber: int):
+    """Tampung sample CSQ, flush ke DB kalau batch penuh / sudah lewat CSQ_FLUSH_SECS."""
+    csq_pending.append((ts, rssi, dbm, ber))
+
+    if (len(csq_pending) >= CSQ_BATCH_SIZE
+            or time.monotonic() - last_csq_flush >= CSQ_FLUSH_SECS):
+        flush_csq()
+
+
+def flush_csq():
+    global last_csq_flush
+
+    with csq_pending_lock:
+        rows = list(csq_pending)
+        csq_pending.clear()
+        last_csq_flush = time.monotonic()
+
+    if not rows:
+        return
+
+    try:
+        insert_csq_many(rows)
+    except Exception as e:
+        log(f"[ERROR] DB batch insert ({len(rows)} rows): {e}")
+
+
+# sisa sample jangan hilang waktu service berhenti
+atexit.register(flush_csq)
+
+
+# ==================================================
+# CLOUD SYNC (queue + worker, di luar jalur polling)
+# ==================================================
+CLOUD_BATCH_MAX = 50
+CLOUD_RETRY_DELAY = 5
+
+cloud_queue = Queue(maxsize=10000)
+
+# 1 session keep-alive (dipakai hanya oleh cloud worker) → tanpa TCP/TLS handshake per POST
+cloud_session = requests.Session()
+cloud_adapter = HTTPAdapter(
+    pool_connections=1,
+    pool_maxsize=4,
+    max_retries=Retry(
+        total=3,
+        backoff_factor=0.5
+        # allowed_methods default: POST /history/batch tidak idempotent, jadi
+        # hanya connect error yang di-retry di sini (request belum terkirim);
+        # 5xx ditangani retry loop cloud_worker_loop
+    )
+)
+cloud_session.mount("https://", cloud_adapter)
+cloud_session.mount("http://", cloud_adapter)
+
+
+def send_to_cloud(ts: int, rssi: int, dbm: float, ber: int):
+    """Antrikan sample untuk dikirim worker cloud. Tidak pernah blok polling."""
+    if not CLOUD_URL:
+        return
+
     try:
-        conn = sqlite3.connect(DB_PATH, timeout=10)
-        cur = conn.cursor()
-        cur.execute(
-            "INSERT INTO csq_log (timestamp, rssi, dbm, ber) VALUES (?, ?, ?, ?)",
-            (ts, rssi, dbm, ber),
+        cloud_queue.put_nowait(
+            {"timestamp": ts, "rssi": rssi, "dbm": dbm, "ber": ber}
         )
-        conn.commit()
-        conn.close()
-    except Exception as e:
-        log(f"[ERROR] DB insert: {e}")
+    except Full:
+        log("[CLOUD][WARN] Queue penuh, sample dibuang")
+
+
+def cloud_worker_loop():
+    log(f"[CLOUD] Worker started → {CLOUD_URL}")
+
+    while True:
+        batch = [cloud_queue.get()]
+        while len(batch) < CLOUD_BATCH_MAX and not cloud_queue.empty():
+            batch.append(cloud_queue.get_nowait())
+
+        # offline / 5xx → batch yang sama dicoba lagi, sample baru tetap antri
+        while True:
+            try:
+                resp = cloud_session.post(
+                    f"{CLOUD_URL}/history/batch",
+                    json=batch,
+                    timeout=5
+                )
+            except requests.RequestException as e:
+                log(f"[CLOUD][ERROR] Kirim {len(batch)} rows gagal: {e}")
+                time.sleep(CLOUD_RETRY_DELAY)
+                continue
+
+            if resp.status_code >= 500:
+                log(f"[CLOUD][ERROR] Server {resp.status_code}, {len(batch)} rows dicoba lagi")
+                time.sleep(CLOUD_RETRY_DELAY)
+                continue
+
+            # 4xx permanen → batch dibuang supaya uplink tidak macet
+            if resp.status_code >= 400:
+                log(
+                    f"[CLOUD][ERROR] Batch ditolak ({resp.status_code}): "
+                    f"{resp.text[:200]} → {len(batch)} rows dibuang: {batch}"
+                )
+            break
 
 
 # ==================================================
@@ -464,24 +719,19 @@ def insert_csq(ts: int, rssi: int, dbm: float, ber: int):
 # ==================================================
 def log_call_db(source, number, status, cause_code=None, cause_desc=None):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-
-        cur.execute("""
-            INSERT INTO call_logs 
-            (timestamp, source, number, status, cause_code, cause_desc)
-            VALUES (?, ?, ?, ?, ?, ?)
-        """, (
-            int(time.time()),
-            source,
-            number,
-            status,
-            cause_code,
-            cause_desc
-        ))
-
-        conn.commit()
-        conn.close()
+        with write_conn() as conn:
+            conn.execute("""
+                INSERT INTO call_logs 
+                (timestamp, source, number, status, cause_code, cause_desc)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (
+                int(time.time()),
+                source,
+                number,
+                status,
+                cause_code,
+                cause_desc
+            ))
 
         log(f"[DB] Call logged: {number} {status} cause={cause_code}")
 
@@ -494,21 +744,16 @@ def log_call_db(source, number, status, cause_code=None, cause_desc=None):
 # ==================================================
 def log_sms_db(source, number, status):
     try:
-        conn = sqlite3.connect(DB_PATH)
-        cur = conn.cursor()
-
-        cur.execute("""
-            INSERT INTO sms_logs (timestamp, source, number, status)
-            VALUES (?, ?, ?, ?)
-        """, (
-            int(time.time()),
-            source,
-            number,
-            status
-        ))
-
-        conn.commit()
-        conn.close()
+        with write_conn() as conn:
+            conn.execute("""
+                INSERT INTO sms_logs (timestamp, source, number, status)
+                VALUES (?, ?, ?, ?)
+            """, (
+                int(time.time()),
+                source,
+                number,
+                status
+            ))
 
         log(f"[DB] SMS logged: {number} {status}")
 
@@ -519,32 +764,84 @@ def log_sms_db(source, number, status):
 # ==================================================
 # HISTORY QUERY
 # ==================================================
-def get_history(limit: int = 300, start: int | None = None, end: int | None = None):
-    conn = sqlite3.connect(DB_PATH)
-    cur = conn.cursor()
+HISTORY_MAX_LIMIT = 10000   # batas atas ?limit= supaya query & JSON tetap kecil
+INT64_MIN = -(2 ** 63)      # range INTEGER SQLite
+INT64_MAX = 2 ** 63 - 1
+HISTORY_AGG_BUCKETS = (10, 30, 60, 300, 3600)   # detik
 
-    if start is not None and end is not None:
-        sql = """
-            SELECT timestamp, rssi, dbm, ber FROM csq_log
-            WHERE timestamp BETWEEN ? AND ?
-            ORDER BY timestamp ASC LIMIT ?
-        """
-        cur.execute(sql, (start, end, limit))
-    else:
-        sql = """
-            SELECT timestamp, rssi, dbm, ber FROM csq_log
-            ORDER BY timestamp ASC LIMIT ?
-        """
-        cur.execute(sql, (limit,))
 
-    rows = cur.fetchall()
-    conn.close()
+def get_history(limit: int = 300, start: int | None = None, end: int | None = None,
+                columns: bool = False):
+    with read_conn() as conn:
+        rows = conn.execute(SQL_HISTORY_CSQ, (start, end, limit)).fetchall()
+
+    # columns=True → 1 array per kolom (tanpa dict per row, key tidak berulang)
+    if columns:
+        ts, rssi, dbm, ber = zip(*rows) if rows else ((), (), (), ())
+        return {"timestamp": ts, "rssi": rssi, "dbm": dbm, "ber": ber}
 
     return [
         {"timestamp": r[0], "rssi": r[1], "dbm": r[2], "ber": r[3]}
         for r in rows
     ]
 
+
+def get_history_agg(bucket: int, limit: int = 300, start: int | None = None,
+                    end: int | None = None):
+    """[bucket, avg_dbm, min_dbm, max_dbm, avg_rssi, n] per bucket waktu, urut naik."""
+    with read_conn() as conn:
+        return conn.execute(
+            SQL_HISTORY_AGG_CSQ,
+            (bucket, bucket, start, end, limit)
+        ).fetchall()
+
+
+# ==================================================
+# HISTORY CACHE (TTL pendek, body JSON siap kirim)
+# ==================================================
+HISTORY_CACHE_TTL = 1.5     # detik, < interval polling
+HISTORY_CACHE_MAX = 64
+
+history_cache = {}          # (version, limit, start, end, columns) -> (expires, body)
+history_version = 0         # naik tiap ada data CSQ baru / dihapus
+history_boot_token = time.time_ns()   # beda tiap proses; history_version reset saat restart
+
+
+def bump_history_version():
+    global history_version
+    history_version += 1
+
+
+def get_history_etag() -> str:
+    """
+    ETag /history: timestamp terbaru (1 probe index) + history_version,
+    supaya cleanup / ingest batch yang tidak menggeser MAX tetap terdeteksi.
+    history_boot_token membedakan proses: tanpa itu restart tanpa sample baru
+    menghasilkan tag yang sama walau cleanup sudah menghapus row.
+    """
+    with read_conn() as conn:
+        max_ts = conn.execute(SQL_MAX_TS_CSQ).fetchone()[0]
+    return f"{history_boot_token}-{max_ts or 0}-{history_version}"
+
+
+def get_history_json(limit: int = 300, start: int | None = None, end: int | None = None,
+                     columns: bool = False) -> bytes:
+    """Body JSON /history; query yang sama dalam HISTORY_CACHE_TTL dilayani dari RAM."""
+    key = (history_version, limit, start, end, columns)
+    now = time.monotonic()
+
+    cached = history_cache.get(key)
+    if cached and cached[0] > now:
+        return cached[1]
+
+    body = orjson.dumps({"data": get_history(limit, start, end, columns)})
+
+    if len(history_cache) >= HISTORY_CACHE_MAX:
+        history_cache.clear()
+    history_cache[key] = (now + HISTORY_CACHE_TTL, body)
+
+    return body
+
 CAUSE_MAP = {
     1: "Unassigned number",
     3: "No route to destination",
@@ -608,23 +905,32 @@ def make_call(number: str, call_seconds: int):
             return
 
     try:
+        # URC sisa call sebelumnya jangan terbaca sebagai event call ini
+        drain_queue(urc_queue)
+
         with serial_lock:
-            ser.reset_input_buffer()
-            ser.write(f"ATD{number};\r".encode())
-            time.sleep(0.3)
+            resp = at_command(
+                f"ATD{number};\r".encode(),
+                final=AT_FINAL_RESULTS + CALL_RESULT_CODES
+            )
+        log(f"[CALL] ATD resp: {resp.strip()}")
     except Exception as e:
         log(f"[CALL][ERROR] {e}")
         call_state = "error"
         return
 
-    call_monitor(call_seconds)
+    call_monitor(call_seconds, resp)
 
 
 
 # ==================================================
 # CALL MONITOR 
 # ==================================================
-def call_monitor(timeout_sec: int):
+CLCC_RE = re.compile(r"\+CLCC: \d+,\d+,(\d+),")
+CLCC_POLL_INTERVAL = 1   # detik
+
+
+def call_monitor(timeout_sec: int, dial_resp: str = ""):
     global call_active, call_state, call_stop_by_user
     global last_auto_call_time, active_call
 
@@ -676,16 +982,24 @@ def call_monitor(timeout_sec: int):
         # QUERY MODEM
         # =========================
         with serial_lock:
-            ser.write(b"AT+CLCC\r")
-            time.sleep(0.5)
-            resp = ser.read_all().decode(errors="ignore")
+            resp = at_command(b"AT+CLCC\r")
+
+        # event call (NO CARRIER, +SKCCSI) datang sebagai URC
+        urcs = drain_urcs()
+        if urcs:
+            resp = resp + "\r\n" + urcs
+
+        # respon ATD (mis. NO CARRIER langsung) ikut diproses di putaran pertama
+        if dial_resp:
+            resp = dial_resp + "\r\n" + resp
+            dial_resp = ""
 
         log(f"[CLCC RAW]\n{resp}")
 
         # =========================
         # PARSE CLCC
         # =========================
-        m = re.search(r"\+CLCC: \d+,\d+,(\d+),", resp)
+        m = CLCC_RE.search(resp)
 
         if m:
             stat = int(m.group(1))
@@ -738,15 +1052,15 @@ def call_monitor(timeout_sec: int):
             log("[CALL] NO CARRIER detected")
             break
 
-        time.sleep(1)
+        # tunggu poll CLCC berikut, tapi langsung lanjut kalau ada URC / stop user
+        call_wake.wait(CLCC_POLL_INTERVAL)
+        call_wake.clear()
 
     # =========================
     # HANGUP SAFETY
     # =========================
     with serial_lock:
-        ser.write(b"ATH\r")
-        time.sleep(1)
-        ser.read_all()
+        at_command(b"ATH\r")
 
     # =========================
     # FINAL STATUS 
@@ -805,6 +1119,26 @@ def call_monitor(timeout_sec: int):
 
     log(f"[CALL] Finished (status={final_status}, cause={cause_code})")
 
+auto_call_thread = None
+auto_call_thread_lock = threading.Lock()
+
+
+def ensure_auto_call_thread():
+    """Start auto_call_loop sekali saja per proses, saat pertama kali dibutuhkan."""
+    global auto_call_thread
+
+    with auto_call_thread_lock:
+        if auto_call_thread is not None:
+            return
+
+        auto_call_thread = threading.Thread(
+            target=auto_call_loop,
+            daemon=True
+        )
+        auto_call_thread.start()
+        log("[INIT] Auto call thread started")
+
+
 def auto_call_loop():
     global auto_call_enabled
     global auto_call_interval, auto_call_number, auto_call_duration
@@ -813,22 +1147,22 @@ def auto_call_loop():
     log("[AUTO CALL] Loop started")
 
     while True:
-        time.sleep(1)
-
-        # Auto call OFF → pass
-        if not auto_call_enabled:
-            continue
+        # Auto call OFF → tidur tanpa wakeup sampai di-enable
+        auto_call_event.wait()
 
-        
         if call_active:
+            wait_time = 1
+        else:
+            wait_time = last_auto_call_time + auto_call_interval - time.time()
+
+        # tunggu interval, bisa dipotong kalau config berubah / auto call dimatikan
+        if wait_time > 0:
+            auto_call_wake.wait(timeout=wait_time)
+            auto_call_wake.clear()
             continue
 
         now = time.time()
 
-        
-        if now - last_auto_call_time < auto_call_interval:
-            continue
-
         log("[AUTO CALL] Queueing auto call")
 
         
@@ -846,24 +1180,58 @@ def auto_call_loop():
 # ==================================================
 # THREAD POLLING
 # ==================================================
+polling_stop = threading.Event()   # set = polling berhenti (shutdown)
+polling_wake = threading.Event()   # bangunkan polling (interval berubah / stop)
+
+
+def stop_polling():
+    polling_stop.set()
+    polling_wake.set()
+
+
 def polling_loop():
     global current_interval
 
-    while True:
+    # monotonic: jadwal tidak loncat kalau jam sistem dikoreksi NTP
+    last_poll = None
+
+    while not polling_stop.is_set():
 
         
         if sms_session_active or call_active:
-            time.sleep(0.2)
+            # sample yang sudah ditampung jangan nyangkut selama call / SMS
+            if csq_pending and time.monotonic() - last_csq_flush >= CSQ_FLUSH_SECS:
+                flush_csq()
+
+            polling_stop.wait(0.2)
             continue
 
+        now = time.monotonic()
+
+        if last_poll is not None:
+            sleep_time = last_poll + current_interval - now
+            if sleep_time > 0:
+                # dihitung ulang kalau /config/interval mengubah interval
+                polling_wake.wait(sleep_time)
+                polling_wake.clear()
+                continue
+
+        last_poll = now
+
         rssi, dbm, ber = read_csq_once()
         ts = int(time.time())
 
         if rssi is not None:
-            insert_csq(ts, rssi, dbm, ber)
+            queue_csq(ts, rssi, dbm, ber)
+            send_to_cloud(ts, rssi, dbm, ber)
             log(f"[SIGNAL] RSSI={rssi}, dBm={dbm}, BER={ber}")
 
-        time.sleep(current_interval)
+    log("[POLLING] Stopped")
+
+
+# stop polling dulu sebelum sisa batch di-flush (atexit jalan LIFO)
+atexit.register(stop_polling)
+
 
 def encode_pdu_via_webpdu(smsc, number, message):
     url = "https://www.smsdeliverer.com/online-sms-pdu-encoder.aspx"
@@ -909,16 +1277,149 @@ def signal_now():
     })
 
 
+def parse_history_args():
+    """
+    Validasi + cast limit/start/end sekali untuk /history & /history/agg.
+    Return (limit, start, end, None) atau (None, None, None, response 400).
+    """
+    def optional_int(name, default=None):
+        raw = request.args.get(name)
+        if raw is None:
+            return default
+        value = int(raw)
+        if not INT64_MIN <= value <= INT64_MAX:
+            raise ValueError(name)
+        return value
+
+    try:
+        limit = optional_int("limit", 300)
+        start = optional_int("start")
+        end = optional_int("end")
+    except ValueError:
+        return None, None, None, (jsonify(
+            {"status": "error", "message": "limit/start/end harus integer"}
+        ), 400)
+
+    if start is not None and end is not None and start >= end:
+        return None, None, None, (jsonify(
+            {"status": "error", "message": "start harus < end"}
+        ), 400)
+
+    limit = max(1, min(limit, HISTORY_MAX_LIMIT))
+    return limit, start, end, None
+
+
 @app.route("/history", methods=["GET", "OPTIONS"])
 def history():
     if request.method == "OPTIONS":
         return jsonify({"ok": True}), 200
 
-    limit = request.args.get("limit", 300, type=int)
-    start = request.args.get("start", None, type=int)
-    end = request.args.get("end", None, type=int)
+    limit, start, end, error = parse_history_args()
+    if error:
+        return error
+
+    columns = request.args.get("format") == "columns"
+
+    # data belum berubah → 304 tanpa query history & tanpa body
+    etag = get_history_etag()
+    if request.if_none_match.contains(etag):
+        resp = app.response_class(status=304)
+        resp.set_etag(etag)
+        return resp
+
+    resp = app.response_class(
+        get_history_json(limit, start, end, columns),
+        mimetype="application/json"
+    )
+    resp.set_etag(etag)
+    return resp
+
+
+@app.route("/history/agg", methods=["GET"])
+def history_agg():
+    # bucket=abc harus 400, bukan diam-diam jadi default 60
+    raw_bucket = request.args.get("bucket", "60")
+    try:
+        bucket = int(raw_bucket)
+    except ValueError:
+        bucket = None
+
+    if bucket not in HISTORY_AGG_BUCKETS:
+        return jsonify(
+            {"status": "error", "message": f"bucket harus salah satu {list(HISTORY_AGG_BUCKETS)}"}
+        ), 400
+
+    limit, start, end, error = parse_history_args()
+    if error:
+        return error
+
+    return app.response_class(
+        orjson.dumps({
+            "bucket": bucket,
+            "data": get_history_agg(bucket, limit, start, end)
+        }),
+        mimetype="application/json"
+    )
+
+
+HISTORY_BATCH_MAX_ROWS = CLOUD_BATCH_MAX * 20
+
+
+@app.route("/history/batch", methods=["POST"])
+def history_batch():
+    """Ingest batch CSQ dari device lain (dipakai cloud sync)."""
+    data = request.json
+    if not isinstance(data, list):
+        return jsonify({"status": "error", "msg": "JSON array required"}), 400
+
+    # 1 transaksi pegang write_lock & blok event loop gevent → batasi ukurannya
+    if len(data) > HISTORY_BATCH_MAX_ROWS:
+        return jsonify({
+            "status": "error",
+            "msg": f"max {HISTORY_BATCH_MAX_ROWS} rows per request"
+        }), 413
+
+    def as_int(value):
+        # bool turunan int; inf / di luar INTEGER SQLite (64-bit) → ditolak
+        if isinstance(value, bool):
+            raise TypeError("bool")
+        value = int(value)
+        if not INT64_MIN <= value <= INT64_MAX:
+            raise OverflowError("out of int64 range")
+        return value
+
+    def as_float(value):
+        if isinstance(value, bool):
+            raise TypeError("bool")
+        value = float(value)
+        if not math.isfinite(value):
+            raise ValueError("non-finite")
+        return value
+
+    def optional(cast, value):
+        return None if value is None else cast(value)
+
+    try:
+        rows = [
+            (
+                as_int(r["timestamp"]),
+                optional(as_int, r.get("rssi")),
+                optional(as_float, r.get("dbm")),
+                optional(as_int, r.get("ber")),
+            )
+            for r in data
+        ]
+    except (TypeError, KeyError, ValueError, AttributeError, OverflowError):
+        return jsonify({"status": "error", "msg": "invalid row"}), 400
+
+    if rows:
+        try:
+            insert_csq_many(rows)
+        except Exception as e:
+            log(f"[API][ERROR] history_batch: {e}")
+            return jsonify({"status": "error", "msg": "DB insert failed"}), 500
 
-    return jsonify({"data": get_history(limit, start, end)})
+    return jsonify({"status": "ok", "inserted": len(rows)})
 
 
 @app.route("/config/interval", methods=["GET"])
@@ -932,6 +1433,7 @@ def config_interval():
         ), 400
 
     current_interval = new_interval
+    polling_wake.set()
     log(f"[CONFIG] Interval diubah menjadi {new_interval}s")
     return jsonify({"status": "ok", "interval": new_interval})
 
@@ -964,6 +1466,7 @@ def stop_call():
         return jsonify({"ok": True}), 200
 
     call_stop_by_user = True
+    call_wake.set()
     log("[CALL] stop_call triggered by user")
 
     return jsonify({
@@ -982,6 +1485,10 @@ def config_auto_call():
     auto_call_interval = int(data.get("interval", 60))
     auto_call_number = data.get("number", "")
     auto_call_duration = int(data.get("duration", 15))
+    apply_auto_call_state()
+
+    if auto_call_enabled:
+        ensure_auto_call_thread()
 
     log(
         f"[CONFIG] Auto Call enabled={auto_call_enabled}, "
@@ -1234,6 +1741,9 @@ def send_sms():
     })
 
 
+SMS_SEND_TIMEOUT = 10   # detik, tunggu +CMGS / OK setelah PDU dikirim
+
+
 def send_sms_internal(number: str, message: str):
     global sms_sending, sms_session_active
 
@@ -1255,42 +1765,26 @@ def send_sms_internal(number: str, message: str):
         log(f"[SMS] FULL PDU    : {full_pdu}")
 
         with serial_lock:
-            ser.reset_input_buffer()
-
-            ser.write(b"AT\r")
-            time.sleep(1)
-            ser.read_all()
-
-            ser.write(b"AT+CSMS=1\r")
-            time.sleep(1)
-            ser.read_all()
-
-            ser.write(b"AT+CMGF=0\r")
-            time.sleep(1)
-            ser.read_all()
-
-            # CMGS
-            ser.write(f"AT+CMGS={tpdu_len}\r".encode())
-
-            buf = ""
-            start = time.time()
-
-            while time.time() - start < 20:
-                if ser.in_waiting:
-                    ch = ser.read(1).decode(errors="ignore")
-                    buf += ch
-                    if ch == ">":
-                        break
-                time.sleep(0.05)
+            at_command(b"AT\r")
+            at_command(b"AT+CSMS=1\r")
+            at_command(b"AT+CMGF=0\r")
+
+            # CMGS → tunggu prompt '>'
+            buf = at_command(
+                f"AT+CMGS={tpdu_len}\r".encode(),
+                timeout=20,
+                final=(b">",) + AT_FINAL_RESULTS
+            )
 
             if ">" not in buf:
                 raise Exception("No '>' prompt from modem")
 
-            ser.write((full_pdu + "\x1A\r").encode())
+            # respon modem
+            resp = at_command(
+                (full_pdu + "\x1A\r").encode(),
+                timeout=SMS_SEND_TIMEOUT
+            )
 
-        # respon modem
-        time.sleep(2)
-        resp = ser.read_all().decode(errors="ignore")
         log(f"[SMS] MODEM RESP: {resp}")
 
         # Delay async ISAT
@@ -1417,17 +1911,9 @@ def task_worker_loop():
 @app.route("/sms/check", methods=["GET"])
 def sms_check():
     with serial_lock:
-        ser.write(b"AT+CREG?\r")
-        time.sleep(0.5)
-        r1 = ser.read_all().decode(errors="ignore")
-
-        ser.write(b"AT+CSMS?\r")
-        time.sleep(0.5)
-        r2 = ser.read_all().decode(errors="ignore")
-
-        ser.write(b"AT+CSCA?\r")
-        time.sleep(0.5)
-        r3 = ser.read_all().decode(errors="ignore")
+        r1 = at_command(b"AT+CREG?\r")
+        r2 = at_command(b"AT+CSMS?\r")
+        r3 = at_command(b"AT+CSCA?\r")
 
     return {
         "CREG": r1,
@@ -1467,29 +1953,41 @@ def config_auto_sms():
 
 @app.route("/")
 def home():
-    return jsonify({"status": "ok", "message": "ISAT Backend aktif"})
+    return jsonify({
+        "status": "ok",
+        "message": "ISAT Backend aktif",
+        "history": {
+            "max_limit": HISTORY_MAX_LIMIT,
+            "params": f"limit (1–{HISTORY_MAX_LIMIT}), start < end (unix), format=columns",
+            "agg_buckets": HISTORY_AGG_BUCKETS
+        }
+    })
 
 # ==============================
-# START POLLING THREAD
+# START SERIAL READER
 # ==============================
-polling_thread = threading.Thread(
-    target=polling_loop,
+serial_reader_thread = threading.Thread(
+    target=serial_reader_loop,
     daemon=True
 )
-polling_thread.start()
-log("[INIT] Polling thread started")
+serial_reader_thread.start()
+log("[INIT] Serial reader started")
+
+
+# ==============================
+# START POLLING GREENLET
+# ==============================
+polling_greenlet = gevent.spawn(polling_loop)
+log("[INIT] Polling greenlet started")
 
 
 
 # ==============================
-# START AUTO CALL THREAD
+# START AUTO CALL THREAD (lazy)
 # ==============================
-auto_call_thread = threading.Thread(
-    target=auto_call_loop,
-    daemon=True
-)
-auto_call_thread.start()
-log("[INIT] Auto call thread started")
+# baru jalan kalau auto call ON dari config.json, atau nanti via /config/auto-call
+if auto_call_enabled:
+    ensure_auto_call_thread()
 
 
 auto_sms_thread = threading.Thread(
@@ -1507,6 +2005,18 @@ cleanup_thread.start()
 log("[INIT] Cleanup thread started")
 
 
+# ==============================
+# START CLOUD WORKER (opsional)
+# ==============================
+if CLOUD_URL:
+    cloud_worker_thread = threading.Thread(
+        target=cloud_worker_loop,
+        daemon=True
+    )
+    cloud_worker_thread.start()
+    log("[INIT] Cloud worker started")
+
+
 # ==============================
 # START TASK WORKER (FIFO)
 # ==============================
@@ -1522,7 +2032,16 @@ log("[INIT] Task worker started")
 # ==================================================
 # MAIN
 # ==================================================
+# Production: gunicorn -k gevent -w 1 isat_service:app (lihat Procfile).
+# Worker harus 1 karena port serial hanya boleh dibuka satu proses.
 if __name__ == "__main__":
-    log(f"[START] Flask running on 0.0.0.0:{FLASK_PORT}")
-    app.run(host="0.0.0.0", port=FLASK_PORT)
+    log(f"[START] gevent WSGI running on 0.0.0.0:{FLASK_PORT}")
+    server = WSGIServer(("0.0.0.0", FLASK_PORT), app)
+
+    # SIGTERM (systemd / docker stop) → server berhenti normal supaya atexit
+    # (stop polling + flush batch CSQ) tetap jalan, bukan cuma saat Ctrl-C
+    gevent.signal_handler(signal.SIGTERM, server.stop)
+
+    server.serve_forever()
+    log("[STOP] Server stopped")
 +870772001799